@@ -3,37 +3,57 @@ from datetime import datetime
 
 import aiohttp
 import matplotlib.pyplot as plt
+import numexpr as ne
+import numpy as np
+import orjson
 import pandas as pd
 import streamlit as st
 
 OPENWEATHERMAP_WEATHER_API_URL = "http://api.openweathermap.org/data/2.5/weather"
 OPENWEATHERMAP_GEO_API_URL = "http://api.openweathermap.org/geo/1.0/direct"
+SEASONS = ["winter", "spring", "summer", "autumn"]
 MONTH_TO_SEASON = {
     12: "winter", 1: "winter", 2: "winter",
     3: "spring", 4: "spring", 5: "spring",
     6: "summer", 7: "summer", 8: "summer",
     9: "autumn", 10: "autumn", 11: "autumn",
 }
+SEASON_BY_MONTH = np.array([""] + [MONTH_TO_SEASON[month] for month in range(1, 13)])
 
 
-async def get_current_temperature_async(city, api_key):
+async def get_current_temperature_async(session, city, api_key):
     params = {
         "q": city,
         "appid": api_key,
         "units": "metric",
     }
-    async with aiohttp.ClientSession() as session:
-        async with session.get(OPENWEATHERMAP_WEATHER_API_URL, params=params) as response:
+    async with session.get(OPENWEATHERMAP_WEATHER_API_URL, params=params) as response:
+        if response.status != 200:
+            st.write(await response.json(loads=orjson.loads))
+            return None
+        data = await response.json(loads=orjson.loads)
+        return data["main"]["temp"]
+
+
+async def get_city_location_async(session, city, api_key):
+    params = {
+        "q": city,
+        "limit": 1,
+        "appid": api_key,
+    }
+    try:
+        async with session.get(OPENWEATHERMAP_GEO_API_URL, params=params) as response:
             if response.status != 200:
-                st.write(await response.json())
                 return None
-            data = await response.json()
-            return data["main"]["temp"]
+            data = await response.json(loads=orjson.loads)
+    except (aiohttp.ClientError, asyncio.TimeoutError, orjson.JSONDecodeError):
+        return None
+    return data[0] if data else None
 
 
-def is_temperature_normal(city_data, current_city_temp, season):
-    seasonal_mean = city_data[city_data['season'] == season]['temp_m_mean'].values[0]
-    seasonal_std = city_data[city_data['season'] == season]['temp_m_std'].values[0]
+def is_temperature_normal(season_stats, current_city_temp, season):
+    seasonal_mean = season_stats[season]["mean"]
+    seasonal_std = season_stats[season]["std"]
     return seasonal_mean - 2 * seasonal_std <= current_city_temp <= seasonal_mean + 2 * seasonal_std
 
 
@@ -45,11 +65,35 @@ def rolling_std(x):
     return x.rolling(window=30, center=True).std()
 
 
+def load_data(file):
+    df = pd.read_csv(file, engine="pyarrow")
+    df["timestamp"] = pd.to_datetime(df["timestamp"])
+    if "season" not in df.columns:
+        df["season"] = SEASON_BY_MONTH[df["timestamp"].dt.month.to_numpy()]
+    df["city"] = df["city"].astype("category")
+    df["season"] = df["season"].astype(pd.CategoricalDtype(SEASONS))
+    return df.sort_values(["city", "timestamp"], ignore_index=True)
+
+
+@st.cache_resource(max_entries=2)
+def load_city_groups(file):
+    data = load_data(file)
+    return dict(iter(data.groupby("city", observed=True, sort=False)))
+
+
+@st.cache_data
 def process_data(df):
-    df["temp_m_mean"] = df.groupby("city")["temperature"].transform(rolling_mean)
-    df["temp_m_std"] = df.groupby("city")["temperature"].transform(rolling_std)
-    df["anomaly"] = ((df["temperature"] < df["temp_m_mean"] - 2 * df["temp_m_std"])
-                     | (df["temperature"] > df["temp_m_mean"] + 2 * df["temp_m_std"]))
+    df = df.copy()
+    df["temp_m_mean"] = rolling_mean(df["temperature"])
+    df["temp_m_std"] = rolling_std(df["temperature"])
+    df["anomaly"] = ne.evaluate(
+        "(t < m - 2 * s) | (t > m + 2 * s)",
+        local_dict={
+            "t": df["temperature"].to_numpy(),
+            "m": df["temp_m_mean"].to_numpy(),
+            "s": df["temp_m_std"].to_numpy(),
+        },
+    )
     return df
 
 
@@ -57,46 +101,48 @@ async def main():
     uploaded_file = st.file_uploader("Choose a CSV file with temperature data")
 
     if uploaded_file is not None:
-        data = pd.read_csv(uploaded_file)
-        data["timestamp"] = pd.to_datetime(data["timestamp"])
+        city_groups = load_city_groups(uploaded_file)
 
-        selected_city = st.selectbox("Выберите город", data["city"].unique())
-        seasons = data["season"].unique()
-        city_data = data[data["city"] == selected_city]
-        city_data = process_data(city_data)
+        selected_city = st.selectbox("Выберите город", list(city_groups))
+        city_data = process_data(city_groups[selected_city])
 
         st.header(f"Статистика по {selected_city}")
         st.write(city_data.describe())
 
         st.subheader("Температурный ряд")
-        plt.figure(figsize=(10, 6))
-        plt.plot(city_data["timestamp"], city_data["temperature"], marker="o")
-        plt.title("Температурный ряд")
-        plt.xlabel("Дата")
-        plt.ylabel("Температура (°C)")
-        plt.grid(True)
-        st.pyplot(plt)
+        fig, ax = plt.subplots(figsize=(10, 6))
+        ax.plot(city_data["timestamp"], city_data["temperature"], marker="o")
+        ax.set_title("Температурный ряд")
+        ax.set_xlabel("Дата")
+        ax.set_ylabel("Температура (°C)")
+        ax.grid(True)
+        st.pyplot(fig)
+        plt.close(fig)
 
         st.subheader("Аномалии")
         anomalies = city_data[city_data["anomaly"]]
-        plt.figure(figsize=(10, 6))
-        plt.plot(city_data["timestamp"], city_data["temperature"], label="Температура")
-        plt.scatter(
+        fig, ax = plt.subplots(figsize=(10, 6))
+        ax.plot(city_data["timestamp"], city_data["temperature"], label="Температура")
+        ax.scatter(
             anomalies["timestamp"], anomalies["temperature"], color="red", label="Аномалии"
         )
-        plt.xlabel("Дата")
-        plt.ylabel("Температура, °C")
-        plt.title("Аномалии")
-        plt.legend()
-        plt.grid(True)
-        st.pyplot(plt)
+        ax.set_xlabel("Дата")
+        ax.set_ylabel("Температура, °C")
+        ax.set_title("Аномалии")
+        ax.legend()
+        ax.grid(True)
+        st.pyplot(fig)
+        plt.close(fig)
 
         st.subheader("Сезонные профили")
         season_profile = (
-            city_data.groupby("season")["temp_m_mean"].agg(["mean", "std"]).reset_index()
+            city_data.groupby("season", observed=True)["temp_m_mean"].agg(["mean", "std"]).reset_index()
+        )
+        season_stats = (
+            city_data.groupby("season", observed=True)["temperature"].agg(["mean", "std"]).to_dict("index")
         )
-        plt.figure(figsize=(10, 6))
-        plt.errorbar(
+        fig, ax = plt.subplots(figsize=(10, 6))
+        ax.errorbar(
             season_profile["season"],
             season_profile["mean"],
             yerr=season_profile["std"],
@@ -107,72 +153,80 @@ async def main():
             mew=4,
             label="Средняя температура",
         )
-        plt.xticks(ticks=range(len(seasons)), labels=season_profile["season"].unique())
-        plt.xlabel("Время года")
-        plt.ylabel("Температура, °C")
-        plt.title("Сезонные профили температуры")
-        plt.grid(True)
-        for i, row in season_profile.iterrows():
-            plt.text(
-                row["season"],
-                row["mean"] + 0.75,
-                f"         {round(row['mean'], 2)}",
+        ax.set_xticks(ticks=range(len(season_profile)), labels=season_profile["season"])
+        ax.set_xlabel("Время года")
+        ax.set_ylabel("Температура, °C")
+        ax.set_title("Сезонные профили температуры")
+        ax.grid(True)
+        for season, mean in zip(season_profile["season"].to_numpy(), season_profile["mean"].to_numpy()):
+            ax.text(
+                season,
+                mean + 0.75,
+                f"         {round(mean, 2)}",
                 ha="center",
                 va="bottom",
             )
-        st.pyplot(plt)
+        st.pyplot(fig)
+        plt.close(fig)
 
         st.header("Работа с OpenWeatherMap")
         api_key = st.text_input("Введите API-ключ OpenWeatherMap")
 
         if api_key:
-            current_temp = await get_current_temperature_async(selected_city, api_key)
+            async with aiohttp.ClientSession() as session:
+                current_temp, location = await asyncio.gather(
+                    get_current_temperature_async(session, selected_city, api_key),
+                    get_city_location_async(session, selected_city, api_key),
+                )
             if not current_temp:
                 return
 
+            if location:
+                st.write(f"Координаты города {selected_city}: {location['lat']}, {location['lon']}")
             st.write(f"Текущая температура в городе {selected_city}: {current_temp} °C")
             now = datetime.now()
             st.write(f"Текущий сезон: {MONTH_TO_SEASON[now.month]} ({now})")
 
             st.subheader("Классификация: нормальная / не нормальная")
-            plt.figure(figsize=(10, 6))
-            plt.errorbar(
+            fig, ax = plt.subplots(figsize=(10, 6))
+            ax.errorbar(
                 season_profile["season"],
                 season_profile["mean"],
                 yerr=season_profile["std"],
                 marker='o',
                 label="Средняя температура",
             )
-            plt.scatter(MONTH_TO_SEASON[now.month], current_temp, color="red", label="Текущая температура")
-            plt.text(
+            ax.scatter(MONTH_TO_SEASON[now.month], current_temp, color="red", label="Текущая температура")
+            ax.text(
                 MONTH_TO_SEASON[now.month],
                 current_temp + 0.75,
                 f"         {round(current_temp, 2)}",
                 ha="center",
                 va="bottom",
             )
-            plt.xticks(ticks=range(len(seasons)), labels=season_profile["season"].unique())
-            plt.xlabel("Время года")
-            plt.ylabel("Температура, °C")
-            plt.title("Сезонные профили температуры")
-            plt.grid(True)
-            for i, row in season_profile.iterrows():
-                plt.text(
-                    row["season"],
-                    row["mean"] + 1.1,
-                    f"         {round(row['mean'], 2)}",
+            ax.set_xticks(ticks=range(len(season_profile)), labels=season_profile["season"])
+            ax.set_xlabel("Время года")
+            ax.set_ylabel("Температура, °C")
+            ax.set_title("Сезонные профили температуры")
+            ax.grid(True)
+            for season, mean in zip(season_profile["season"].to_numpy(), season_profile["mean"].to_numpy()):
+                ax.text(
+                    season,
+                    mean + 1.1,
+                    f"         {round(mean, 2)}",
                     ha="center",
                     va="bottom",
                 )
-            plt.legend()
+            ax.legend()
 
-            normal = is_temperature_normal(city_data, current_temp, MONTH_TO_SEASON[now.month])
+            normal = is_temperature_normal(season_stats, current_temp, MONTH_TO_SEASON[now.month])
             if normal:
                 st.write('Температура классифицирована как нормальная')
             else:
                 st.write('Температура классифицирована как не нормальная')
 
-            st.pyplot(plt)
+            st.pyplot(fig)
+            plt.close(fig)
 
 
 asyncio.run(main())